@@ -1,123 +1,326 @@
-import json
-import queue
+import math
 import sys
+import threading
 import time
+from collections import deque
 from pathlib import Path
 
 import numpy as np
 import sounddevice as sd
 from vosk import Model, KaldiRecognizer
 
+try:
+    import orjson as _json   # much faster on the small result dicts Vosk returns
+except ImportError:
+    import json as _json
+
 # -------------------------
 # Config (tune these)
 # -------------------------
-MODEL_DIR = Path(__file__).parent / "models" / "vosk-model-en-us-0.22-lgraph"  # Update if you put your model somewhere else
+# Small model decodes ~2x faster than vosk-model-en-us-0.22-lgraph for a modest WER cost;
+# point this back at the lgraph model if accuracy matters more than CPU.
+MODEL_DIR = Path(__file__).parent / "models" / "vosk-model-small-en-us-0.15"  # Update if you put your model somewhere else
 SAMPLE_RATE = 16000          # Most Vosk models expect 16k
-BLOCK_MS = 30                # 20–40ms is a good low-latency range
+BLOCK_MS = 32                # 512 samples @16k: matches PortAudio's power-of-two host buffers
 BLOCK_SIZE = int(SAMPLE_RATE * BLOCK_MS / 1000)
 DEVICE = None                # Set to an int device index to force a specific mic
 MIN_FINAL_CHARS = 1          # Ignore empty finals
+EMPTY_PARTIAL = '{\n  "partial" : ""\n}'   # Vosk's exact PartialResult() when nothing is heard
+AUDIO_SLOTS = 128            # Audio ring size in blocks (power of two, ~4.1s at 32ms)
+DECODE_BLOCKS = 3            # Blocks per AcceptWaveform call (fewer, larger Kaldi calls)
+DECODE_QUEUE_MAX = 20        # Batches waiting for the decoder (~1.9s) before new audio is dropped
+PARTIAL_THROTTLE_NS = 80_000_000   # Reduce spam (prints at most ~12 times/sec)
+FLUSH_INTERVAL_S = 0.05      # Batch stdout writes into at most one flush per 50ms
+
+# Energy gate: Vosk only sees audio while someone is talking
+GATE_OPEN_DB = 10.0          # Open when this many dB above the noise floor...
+GATE_CLOSE_DB = 5.0          # ...and stay open until it drops below this (hysteresis)
+GATE_MIN_DBFS = -50.0        # Never open below this absolute level
+NOISE_ALPHA = 0.05           # How fast the noise floor follows the room (dB EMA, gate closed)
+NOISE_RISE_ALPHA = 0.001     # ...and how slowly it creeps up while open (~30s per e-fold at 32ms)
+MIN_SPEECH_MS = 64           # Energy must stay up this long before the gate opens
+HANGOVER_MS = 600            # Keep feeding Vosk this long after energy drops, then finalize
+PREROLL_MS = 256             # Audio from before the gate opened, so word onsets aren't clipped
 
 # Duplicate protection
 last_final_text = ""
 
-audio_q: "queue.Queue[np.ndarray]" = queue.Queue(maxsize=50)
+
+class BlockRing:
+    """
+    Single-producer/single-consumer ring of preallocated PCM blocks.
+    The audio callback copies each block into the next free slot, so nothing
+    is allocated on the PortAudio thread. Only the producer moves `head` and
+    only the consumer moves `tail`, so no lock is needed; `ready` just wakes
+    the consumer instead of having it poll.
+    """
+
+    def __init__(self, slots: int, block_bytes: int):
+        if slots & (slots - 1):
+            raise ValueError("slots must be a power of two")
+        self.mask = slots - 1
+        self.views = [memoryview(bytearray(block_bytes)) for _ in range(slots)]
+        self.head = 0
+        self.tail = 0
+        self.ready = threading.Event()
+
+    def push(self, data) -> bool:
+        head = self.head
+        nxt = (head + 1) & self.mask
+        if nxt == self.tail:
+            return False
+        self.views[head][:] = data
+        self.head = nxt
+        if not self.ready.is_set():
+            self.ready.set()
+        return True
+
+    def pop_into(self, out: bytearray) -> bool:
+        """Append the oldest block to `out` (consumer side). False if the ring is empty."""
+        tail = self.tail
+        if tail == self.head:
+            return False
+        out += self.views[tail]
+        self.tail = (tail + 1) & self.mask
+        return True
+
+    def wait(self, timeout: float) -> None:
+        """Sleep until the producer pushes a block (consumer side)."""
+        self.ready.wait(timeout)
+        # Cleared before the caller's next pop_into, so a push can't be missed
+        self.ready.clear()
+
+
+audio_ring = BlockRing(AUDIO_SLOTS, BLOCK_SIZE * 2)
+# deque.append/popleft are atomic, so the gate and decoder threads share it without a lock.
+# Unbounded on purpose: maxlen could evict a b"" marker and splice two utterances together,
+# so the producer caps audio batches itself and always queues the markers.
+decode_q: "deque[bytes]" = deque()   # b"" = end of utterance
+decode_ready = threading.Event()
+
+
+def block_dbfs(block) -> float:
+    """Level of an int16 PCM block in dBFS (0 = full scale)."""
+    x = np.frombuffer(block, dtype=np.int16)
+    # Accumulate in int64 straight from the int16 view: no upcast copy, no overflow
+    rms = math.sqrt(int(np.einsum("i,i->", x, x, dtype=np.int64)) / x.size)
+    return 20.0 * math.log10(rms / 32768.0 + 1e-9)
+
+
+def gate_step(level_db, in_speech, above_ms, hang_ms, noise_db):
+    """
+    Advance the energy gate by one block. Takes and returns the whole gate
+    state as (in_speech, above_ms, hang_ms, noise_db) so the audio loop does
+    a single call per block.
+    """
+    if noise_db is None or level_db < noise_db:
+        noise_db = level_db
+
+    if not in_speech:
+        if level_db >= max(GATE_MIN_DBFS, noise_db + GATE_OPEN_DB):
+            above_ms += BLOCK_MS
+            if above_ms >= MIN_SPEECH_MS:
+                return True, above_ms, HANGOVER_MS, noise_db
+        else:
+            above_ms = 0
+            noise_db += NOISE_ALPHA * (level_db - noise_db)
+        return False, above_ms, hang_ms, noise_db
+
+    # Let the floor creep up while open too, or a louder room (a fan turning
+    # on) would hold the gate open for good. Slow enough that dictation isn't
+    # cut, and any pause quieter than the floor pulls it straight back down.
+    noise_db += NOISE_RISE_ALPHA * (level_db - noise_db)
+    if level_db >= max(GATE_MIN_DBFS, noise_db + GATE_CLOSE_DB):
+        return True, above_ms, HANGOVER_MS, noise_db
+    hang_ms -= BLOCK_MS
+    if hang_ms <= 0:
+        return False, 0, 0, noise_db
+    return True, above_ms, hang_ms, noise_db
 
 def pick_input_device(preferred_substring: str = "Adafruit"):
     """
     Optional helper: auto-pick a device that contains a substring in its name.
     Set preferred_substring=None to skip.
+    Returns (index, device_info) so callers don't have to enumerate again,
+    or (None, None) if nothing matches.
     """
     devices = sd.query_devices()
-    candidates = []
     for i, d in enumerate(devices):
         if d["max_input_channels"] > 0:
             name = d["name"]
             if preferred_substring and preferred_substring.lower() in name.lower():
-                candidates.append((i, name))
-    if candidates:
-        return candidates[0][0]
-    return None
+                return i, d
+    return None, None
 
 def audio_callback(indata, frames, time_info, status):
     if status:
         # Drop status messages to stderr so they don't pollute output
         print(status, file=sys.stderr)
-    # indata is float32 [-1, 1]; convert to int16 PCM expected by Vosk
-    pcm16 = (indata[:, 0] * 32767).astype(np.int16)
-    try:
-        audio_q.put_nowait(pcm16)
-    except queue.Full:
-        # If we're falling behind, drop audio to keep latency low
-        pass
+    # indata is already int16 mono PCM (what Vosk expects); copy it into the ring.
+    # If we're falling behind the ring is full and the block is dropped to keep latency low.
+    audio_ring.push(indata)
 
-def main():
+def print_final(text: str) -> bool:
     global last_final_text
 
+    # Prevent blank finals and duplicates
+    if len(text) >= MIN_FINAL_CHARS and text != last_final_text:
+        last_final_text = text
+        sys.stdout.write(f"\nFINAL: {text}\n\n")
+        return True
+    return False
+
+def decode_worker(rec):
+    """
+    Runs Vosk on batches from decode_q and prints results. Kept off the main
+    thread so a slow decode never stops the audio ring from being drained.
+    An empty batch means the gate closed: flush the utterance.
+    Output is written unflushed and pushed out at most every FLUSH_INTERVAL_S
+    (or as soon as the decoder goes idle) to keep write() syscalls down;
+    with nothing left to flush, an idle worker just sleeps on decode_ready.
+    """
+    out = sys.stdout
+    partial_last = ""
+    last_partial_print_ns = 0
+    last_flush_ns = 0
+    flush_interval_ns = int(FLUSH_INTERVAL_S * 1_000_000_000)
+    dirty = False   # written since the last flush
+
+    while True:
+        if not decode_q:
+            # Only time out if there is output waiting to be flushed
+            decode_ready.wait(FLUSH_INTERVAL_S if dirty else None)
+            decode_ready.clear()
+            if not decode_q:
+                if dirty:
+                    out.flush()
+                    dirty = False
+                continue
+        data_bytes = decode_q.popleft()
+
+        now = time.monotonic_ns()
+        if dirty and (now - last_flush_ns) >= flush_interval_ns:
+            out.flush()
+            last_flush_ns = now
+            dirty = False
+
+        if not data_bytes:
+            # Gate closed: Vosk never saw the trailing silence, so finalize here
+            # (this also resets the recognizer for the next utterance)
+            text = (_json.loads(rec.FinalResult()).get("text") or "").strip()
+            if print_final(text):
+                dirty = True
+            partial_last = ""
+        elif rec.AcceptWaveform(data_bytes):
+            # Final (utterance ended)
+            text = (_json.loads(rec.Result()).get("text") or "").strip()
+            if print_final(text):
+                dirty = True
+                partial_last = ""  # reset partial tracker
+        else:
+            # Partial (still speaking). Don't ask Kaldi for a hypothesis
+            # we'd throttle away anyway, and skip the parse on silence.
+            if (now - last_partial_print_ns) < PARTIAL_THROTTLE_NS:
+                continue
+            raw = rec.PartialResult()
+            if raw == EMPTY_PARTIAL:
+                continue
+            p = (_json.loads(raw).get("partial") or "").strip()
+
+            if p and p != partial_last:
+                partial_last = p
+                last_partial_print_ns = now
+                # Print partial on same line (low-noise)
+                out.write(f"\rPARTIAL: {p}   ")
+                dirty = True
+
+def main():
     if not MODEL_DIR.exists():
         print(f"Model not found: {MODEL_DIR}")
         print("Put a Vosk model folder inside Voxtext/models/ and update MODEL_DIR.")
         sys.exit(1)
 
     # Optional: auto-select your Adafruit USB mic if found
-    dev = DEVICE
-    if dev is None:
-        dev = pick_input_device("Adafruit")
+    if DEVICE is not None:
+        dev, d = DEVICE, sd.query_devices(DEVICE)
+    else:
+        dev, d = pick_input_device("Adafruit")
 
     if dev is not None:
-        d = sd.query_devices(dev)
         print(f"Using input device {dev}: {d['name']}")
     else:
         print("Using default input device")
 
     model = Model(str(MODEL_DIR))
     rec = KaldiRecognizer(model, SAMPLE_RATE)
-    rec.SetWords(True)
+    # Only the text is printed, so skip per-word timings and alternatives (less lattice work and JSON)
+    rec.SetWords(False)
+    rec.SetMaxAlternatives(0)
 
     # For low-latency partials, keep this enabled:
-    # (Vosk returns partials by default; the logic below prints them in-place.)
+    # (Vosk returns partials by default; decode_worker prints them in-place.)
 
     print("\n--- Voxtext: Offline Streaming STT (Vosk) ---")
     print("Speak into the mic. Ctrl+C to stop.\n")
 
-    partial_last = ""
-    last_partial_print_t = 0.0
-    PARTIAL_THROTTLE_S = 0.08   # reduce spam (prints at most ~12 times/sec)
+    threading.Thread(target=decode_worker, args=(rec,), daemon=True).start()
 
-    with sd.InputStream(
+    with sd.RawInputStream(
         samplerate=SAMPLE_RATE,
         blocksize=BLOCK_SIZE,
         device=dev,
         channels=1,
-        dtype="float32",
+        dtype="int16",
         callback=audio_callback,
     ):
+        block = bytearray()
+        pending = bytearray()
+        preroll = bytearray()
+        decode_bytes = BLOCK_SIZE * 2 * DECODE_BLOCKS
+        preroll_bytes = BLOCK_SIZE * 2 * (PREROLL_MS // BLOCK_MS)
+
+        in_speech = False
+        above_ms = 0
+        hang_ms = 0
+        noise_db = None
+
         try:
             while True:
-                pcm16 = audio_q.get()
-                data_bytes = pcm16.tobytes()
-
-                if rec.AcceptWaveform(data_bytes):
-                    # Final (utterance ended)
-                    res = json.loads(rec.Result())
-                    text = (res.get("text") or "").strip()
-
-                    # Prevent blank finals and duplicates
-                    if len(text) >= MIN_FINAL_CHARS and text != last_final_text:
-                        last_final_text = text
-                        partial_last = ""  # reset partial tracker
-                        print(f"\nFINAL: {text}\n")
-                else:
-                    # Partial (still speaking)
-                    pres = json.loads(rec.PartialResult())
-                    p = (pres.get("partial") or "").strip()
-
-                    now = time.time()
-                    if p and p != partial_last and (now - last_partial_print_t) >= PARTIAL_THROTTLE_S:
-                        partial_last = p
-                        last_partial_print_t = now
-                        # Print partial on same line (low-noise)
-                        print(f"\rPARTIAL: {p}   ", end="", flush=True)
+                block.clear()
+                if not audio_ring.pop_into(block):
+                    audio_ring.wait(0.5)
+                    continue
+
+                was_open = in_speech
+                in_speech, above_ms, hang_ms, noise_db = gate_step(
+                    block_dbfs(block), in_speech, above_ms, hang_ms, noise_db)
+
+                if not in_speech and not was_open:
+                    # Silence: skip Vosk, but remember the last bit for the onset
+                    if preroll_bytes:
+                        preroll += block
+                        del preroll[:-preroll_bytes]
+                    continue
+
+                if in_speech and not was_open:
+                    pending += preroll
+                    preroll.clear()
+
+                pending += block
+                gate_closing = was_open and not in_speech
+                if len(pending) < decode_bytes and not gate_closing:
+                    continue
+
+                # Vosk only accepts bytes, so copy out the batch here, off the audio thread.
+                # Decoder too far behind: drop this batch rather than anything queued
+                if len(decode_q) < DECODE_QUEUE_MAX:
+                    decode_q.append(bytes(pending))
+                pending.clear()
+
+                if gate_closing:
+                    decode_q.append(b"")
+                if not decode_ready.is_set():
+                    decode_ready.set()
 
         except KeyboardInterrupt:
             print("\nStopping...")
@@ -126,4 +329,4 @@ def main():
             pass
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
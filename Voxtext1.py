@@ -1,33 +1,89 @@
-import json
-import queue
+import os
 import sys
 import time
 import threading
+from collections import deque
 from pathlib import Path
 import tkinter as tk
 from tkinter import ttk
 
-import numpy as np
 import sounddevice as sd
 from vosk import Model, KaldiRecognizer
 
+try:
+    import orjson as _json   # much faster on the small result dicts Vosk returns
+except ImportError:
+    import json as _json
+
 # -------------------------
 # Config (same as yours)
 # -------------------------
 MODEL_DIR = Path(__file__).parent / "models" / "vosk-model-en-us-0.22-lgraph"
 SAMPLE_RATE = 16000
-BLOCK_MS = 30
+BLOCK_MS = 120             # Push-to-talk UI tolerates it; ~8 callbacks/s instead of 33
 BLOCK_SIZE = int(SAMPLE_RATE * BLOCK_MS / 1000)
 DEVICE = None
 MIN_FINAL_CHARS = 1
+EMPTY_PARTIAL = '{\n  "partial" : ""\n}'   # Vosk's exact PartialResult() when nothing is heard
+DECODE_BLOCKS = 2           # Callback blocks per AcceptWaveform call (fewer, larger Kaldi calls)
+DECODE_MS = DECODE_BLOCKS * BLOCK_MS   # Kept a multiple of BLOCK_MS so the ping-pong swap really batches
+AUDIO_BUFFER_MS = 2400      # Audio held for the worker before new blocks are dropped
+UI_POLL_MS = 50             # How often the Tk thread applies results posted by the worker
+STT_CPU = 2                 # Linux: pin the STT worker to this core (None to let it float)
+STT_NICE = -5               # Linux: worker niceness boost (needs CAP_SYS_NICE; ignored otherwise)
 
 
 def pick_input_device(preferred_substring: str = "Adafruit"):
+    # Returns (index, device_info) so callers don't have to enumerate again
     devices = sd.query_devices()
     for i, d in enumerate(devices):
         if d.get("max_input_channels", 0) > 0 and preferred_substring.lower() in d.get("name", "").lower():
-            return i
-    return None
+            return i, d
+    return None, None
+
+
+class PingPongBuffer:
+    """
+    Two byte buffers swapped between the audio callback and the STT worker.
+    The callback appends into the fill buffer; the worker swaps it for the
+    spare and takes everything at once, so there is one hand-off per swap
+    instead of a queue put/get (lock + condition notify) per block.
+    """
+
+    def __init__(self, ready_bytes: int, max_bytes: int):
+        self.ready_bytes = ready_bytes
+        self.max_bytes = max_bytes
+        self.ready = threading.Event()
+        self._lock = threading.Lock()
+        self._fill = bytearray()
+        self._spare = bytearray()
+
+    def write(self, data) -> bool:
+        with self._lock:
+            fill = self._fill
+            if len(fill) >= self.max_bytes:
+                return False
+            fill += data
+            full = len(fill) >= self.ready_bytes
+        if full and not self.ready.is_set():
+            self.ready.set()
+        return True
+
+    def swap(self) -> bytes:
+        """Take everything written so far (worker side). May be empty."""
+        self.ready.clear()
+        with self._lock:
+            buf, self._fill = self._fill, self._spare
+            data = bytes(buf)   # Vosk only accepts bytes
+            buf.clear()
+            self._spare = buf
+        return data
+
+    def discard(self) -> None:
+        """Drop everything written so far (Tk side, on a fresh start)."""
+        with self._lock:
+            self._fill.clear()
+        self.ready.clear()
 
 
 class App:
@@ -39,7 +95,8 @@ class App:
         self.btn_var = tk.StringVar(value="Start Listening")
 
         ttk.Label(root, textvariable=self.status_var).pack(padx=12, pady=(12, 6), anchor="w")
-        ttk.Button(root, textvariable=self.btn_var, command=self.toggle).pack(padx=12, pady=6, fill="x")
+        self.btn = ttk.Button(root, textvariable=self.btn_var, command=self.toggle)
+        self.btn.pack(padx=12, pady=6, fill="x")
 
         self.out = tk.Text(root, height=14, wrap="word")
         self.out.pack(padx=12, pady=(6, 12), fill="both", expand=True)
@@ -47,54 +104,110 @@ class App:
 
         self.listening = False
         self.stop_event = threading.Event()
+        self.finalize_requested = threading.Event()
 
-        self.audio_q: "queue.Queue[np.ndarray]" = queue.Queue(maxsize=80)
+        self.audio_buf = PingPongBuffer(SAMPLE_RATE * 2 * DECODE_MS // 1000,
+                                        SAMPLE_RATE * 2 * AUDIO_BUFFER_MS // 1000)
 
         self.model = None
         self.rec = None
         self.stream = None
-        self.worker = threading.Thread(target=self.stt_loop, daemon=True)
+        self.model_ready = threading.Event()
+        self.model_error = None
+        self.worker = threading.Thread(target=self.stt_loop, name="VoxSTT", daemon=True)
 
         self.last_final_text = ""
         self.partial_last = ""
         self.last_partial_print_t = 0.0
         self.PARTIAL_THROTTLE_S = 0.08
 
+        # ("append", text) / ("status", text) / ("stopped", "") posted by stt_loop,
+        # applied on the Tk thread
+        self.ui_events = deque()
+
         self.init_vosk_and_stream()
         self.worker.start()
 
         self.root.protocol("WM_DELETE_WINDOW", self.on_close)
+        self.root.after(UI_POLL_MS, self._drain_ui_events)
 
     def append(self, msg: str):
         self.out.insert("end", msg)
         self.out.see("end")
 
+    def _drain_ui_events(self):
+        # One recurring Tk tick instead of an after(0, lambda) per result
+        while self.ui_events:
+            kind, text = self.ui_events.popleft()
+            if kind == "append":
+                self.append(text)
+            elif kind == "stopped":
+                self.status_var.set("Stopped")
+                self.btn.state(["!disabled"])
+            else:
+                self.status_var.set(text)
+        self.root.after(UI_POLL_MS, self._drain_ui_events)
+
     def init_vosk_and_stream(self):
         if not MODEL_DIR.exists():
             self.append(f"Model not found: {MODEL_DIR}\n")
             self.append("Put the model folder under models/ and update MODEL_DIR.\n")
             raise SystemExit(1)
 
-        dev = DEVICE if DEVICE is not None else pick_input_device("Adafruit")
+        # Loading a large model takes seconds; do it off the Tk thread so the
+        # window shows up right away, and start the stream once it's ready
+        self.status_var.set("Loading model...")
+        self.btn.state(["disabled"])
+        threading.Thread(target=self._load_model, daemon=True).start()
+        self.root.after(100, self._wait_for_model)
+
+    def _load_model(self):
+        try:
+            self.model = Model(str(MODEL_DIR))
+            self.rec = KaldiRecognizer(self.model, SAMPLE_RATE)
+            # Only res["text"] is shown, so skip word timings and alternatives
+            self.rec.SetWords(False)
+            try:
+                self.rec.SetMaxAlternatives(0)
+            except Exception:
+                pass
+        except Exception as e:
+            self.model_error = e
+        self.model_ready.set()
+
+    def _wait_for_model(self):
+        if not self.model_ready.is_set():
+            self.root.after(100, self._wait_for_model)
+            return
+
+        if self.model_error is not None:
+            self.status_var.set("Model failed to load")
+            self.append(f"\nERROR loading model:\n{self.model_error}\n")
+            return
+
+        self._start_stream()
+        self.status_var.set("Stopped")
+        self.btn.state(["!disabled"])
+
+    def _start_stream(self):
+        if DEVICE is not None:
+            dev, d = DEVICE, sd.query_devices(DEVICE)
+        else:
+            dev, d = pick_input_device("Adafruit")
 
         if dev is not None:
-            d = sd.query_devices(dev)
             self.append(f"Using input device {dev}: {d['name']}\n")
         else:
             self.append("Using default input device\n")
 
-        self.model = Model(str(MODEL_DIR))
-        self.rec = KaldiRecognizer(self.model, SAMPLE_RATE)
-        self.rec.SetWords(True)
-
         # Start stream; callback only queues when listening=True
         try:
-            self.stream = sd.InputStream(
+            self.stream = sd.RawInputStream(
                 samplerate=SAMPLE_RATE,
                 blocksize=BLOCK_SIZE,
                 device=dev,
                 channels=1,
-                dtype="float32",
+                dtype="int16",
                 callback=self.audio_callback,
             )
             self.stream.start()
@@ -112,91 +225,109 @@ class App:
         if not self.listening:
             return
 
-        pcm16 = (indata[:, 0] * 32767).astype(np.int16)
-        try:
-            self.audio_q.put_nowait(pcm16)
-        except queue.Full:
-            pass
+        # indata is raw int16 mono PCM; copy it out of PortAudio's buffer.
+        # If the worker is falling behind the buffer is full and the block is dropped.
+        self.audio_buf.write(indata)
 
     def toggle(self):
         if not self.listening:
-            # Start
-            self.listening = True
-            self.status_var.set("Listening...")
-            self.btn_var.set("Stop Listening")
-
+            # Start. stt_loop owns the recognizer and is idle while stopped, so
+            # reset it and clear old buffered audio (fresh start) before listening.
             self.last_final_text = ""
             self.partial_last = ""
             self.last_partial_print_t = 0.0
             self.rec.Reset()
+            self.audio_buf.discard()
 
-            # Clear any old queued chunks (fresh start)
-            while True:
-                try:
-                    self.audio_q.get_nowait()
-                except queue.Empty:
-                    break
-
+            self.listening = True
+            self.status_var.set("Listening...")
+            self.btn_var.set("Stop Listening")
             self.append("▶ Listening started\n")
         else:
-            # Stop + finalize
+            # Stop; stt_loop owns the recognizer, so it does the finalize and
+            # reports back through ui_events. The button stays disabled until then.
+            # Stop the callback first so no block lands after the final swap.
             self.listening = False
+            self.finalize_requested.set()
+            self.audio_buf.ready.set()   # wake the worker now rather than on its next timeout
             self.status_var.set("Finalizing...")
             self.btn_var.set("Start Listening")
+            self.btn.state(["disabled"])
             self.append("■ Listening stopped (finalizing...)\n")
 
-            # Flush whatever is left in queue quickly
-            deadline = time.time() + 0.4
-            while time.time() < deadline:
-                try:
-                    pcm16 = self.audio_q.get_nowait()
-                except queue.Empty:
-                    break
-                self.rec.AcceptWaveform(pcm16.tobytes())
+    def _finalize(self):
+        # Runs on the worker: decode whatever is left in a single Vosk call, then flush
+        data_bytes = self.audio_buf.swap()
+        if data_bytes:
+            self.rec.AcceptWaveform(data_bytes)
 
-            # Finalize
-            try:
-                res = json.loads(self.rec.FinalResult())
-                text = (res.get("text") or "").strip()
-            except Exception:
-                text = ""
+        try:
+            res = _json.loads(self.rec.FinalResult())
+            text = (res.get("text") or "").strip()
+        except Exception:
+            text = ""
 
-            if len(text) >= MIN_FINAL_CHARS and text != self.last_final_text:
-                self.last_final_text = text
-                self.append(f"FINAL: {text}\n\n")
-            else:
-                self.append("FINAL: (nothing detected)\n\n")
+        if len(text) >= MIN_FINAL_CHARS and text != self.last_final_text:
+            self.last_final_text = text
+            self.ui_events.append(("append", f"FINAL: {text}\n\n"))
+        else:
+            self.ui_events.append(("append", "FINAL: (nothing detected)\n\n"))
+        self.ui_events.append(("stopped", ""))
 
-            self.status_var.set("Stopped")
+    def _tune_stt_thread(self):
+        # On Linux, pid 0 here means "this thread": keep Kaldi on one warm core
+        # and ahead of the GUI. Best effort; silently skipped where not allowed.
+        if STT_CPU is not None and hasattr(os, "sched_setaffinity"):
+            try:
+                if STT_CPU in os.sched_getaffinity(0):
+                    os.sched_setaffinity(0, {STT_CPU})
+            except OSError:
+                pass
+        if STT_NICE and hasattr(os, "nice"):
+            try:
+                os.nice(STT_NICE)
+            except OSError:
+                pass
 
     def stt_loop(self):
+        self._tune_stt_thread()
+
         while not self.stop_event.is_set():
-            try:
-                pcm16 = self.audio_q.get(timeout=0.1)
-            except queue.Empty:
+            woke = self.audio_buf.ready.wait(timeout=0.1)
+            if self.finalize_requested.is_set():
+                self.finalize_requested.clear()
+                self._finalize()
                 continue
-
-            if not self.listening:
+            if not woke:
+                continue
+            data_bytes = self.audio_buf.swap()
+            if not data_bytes:
                 continue
 
-            data_bytes = pcm16.tobytes()
+            # Decode it even if listening was turned off since the finalize check:
+            # it's the tail of the recording, and _finalize only sees what's left
 
             if self.rec.AcceptWaveform(data_bytes):
-                res = json.loads(self.rec.Result())
+                res = _json.loads(self.rec.Result())
                 text = (res.get("text") or "").strip()
 
                 if len(text) >= MIN_FINAL_CHARS and text != self.last_final_text:
                     self.last_final_text = text
-                    self.root.after(0, lambda t=text: self.append(f"FINAL: {t}\n\n"))
-            else:
-                # Optional: show partial in the status line (not in textbox)
-                pres = json.loads(self.rec.PartialResult())
-                p = (pres.get("partial") or "").strip()
-                now = time.time()
-                if p and p != self.partial_last and (now - self.last_partial_print_t) >= self.PARTIAL_THROTTLE_S:
+                    self.ui_events.append(("append", f"FINAL: {text}\n\n"))
+            elif self.listening:
+                # Optional: show partial in the status line (not in textbox).
+                # Check the throttle first so we don't fetch a partial we'd discard.
+                now = time.monotonic()
+                if (now - self.last_partial_print_t) < self.PARTIAL_THROTTLE_S:
+                    continue
+                raw = self.rec.PartialResult()
+                if raw == EMPTY_PARTIAL:
+                    continue   # silence: nothing to show, skip the JSON parse
+                p = (_json.loads(raw).get("partial") or "").strip()
+                if p and p != self.partial_last:
                     self.partial_last = p
                     self.last_partial_print_t = now
-                    self.root.after(0, lambda t=p: self.status_var.set(f"Listening... {t}"))
+                    self.ui_events.append(("status", f"Listening... {p}"))
 
     def on_close(self):
         self.stop_event.set()
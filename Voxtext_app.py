@@ -1,23 +1,41 @@
-import json
-import queue
+import os
 import sys
 import time
 import threading
+from collections import deque
 from pathlib import Path
 
-import numpy as np
 import sounddevice as sd
+import vosk
 from vosk import Model, KaldiRecognizer
 
 import customtkinter as ctk
 
+try:
+    import orjson as _json   # much faster on the small result dicts Vosk returns
+except ImportError:
+    import json as _json
+
 # -------------------------
 # Config
 # -------------------------
-MODEL_DIR = Path(__file__).parent / "models" / "vosk-model-en-us-0.22-lgraph"
+MODEL_DIR_LARGE = Path(__file__).parent / "models" / "vosk-model-en-us-0.22-lgraph"
+MODEL_DIR_SMALL = Path(__file__).parent / "models" / "vosk-model-small-en-us-0.15"   # optional fallback
+TARGET_SR = 16000      # rate the Vosk model was trained at; decoding faster audio just costs CPU
 BLOCK_MS = 30
 DEVICE = None          # set to int index if you want to force a device
 MIN_FINAL_CHARS = 1
+AUDIO_SLOTS = 128      # audio ring size in blocks (power of two, ~3.8s at 30ms)
+MAX_BACKLOG_MS = 1500  # if the decoder falls further behind than this, skip the oldest audio
+CHUNK_MS = 120         # audio per AcceptWaveform call (fewer, larger Kaldi calls)
+UI_POLL_MS = 30        # how often the Tk thread picks up text posted by the worker
+ENDPOINTER_MODE = "SHORT"  # vosk.EndpointerMode member: commit finals at shorter pauses (unreleased vosk only)
+TAIL_SILENCE_MS = 200  # silence appended on mute so the last word is fully decoded
+STT_CPU = 1            # Linux: pin the STT worker to this core (None to let it float)
+STT_RT_PRIORITY = 20   # Linux: SCHED_FIFO priority for the worker (needs CAP_SYS_NICE; None/ignored otherwise)
+LAG_TRIGGER_MS = 900   # decoder backlog that counts as "not keeping up"...
+LAG_TRIGGER_S = 5.0    # ...for this long: switch to MODEL_DIR_SMALL on the next mute
+MODEL_CHOICES = {"Large": MODEL_DIR_LARGE, "Small": MODEL_DIR_SMALL}   # header model picker
 
 # UI colors (dark)
 BG = "#0b0f14"
@@ -29,11 +47,72 @@ BORDER = "#1f2937"
 
 
 def pick_input_device(preferred_substring: str = "Adafruit"):
+    # Returns (index, device_info) so callers don't have to enumerate again
     devices = sd.query_devices()
     for i, d in enumerate(devices):
         if d.get("max_input_channels", 0) > 0 and preferred_substring.lower() in d.get("name", "").lower():
-            return i
-    return None
+            return i, d
+    return None, None
+
+
+class BlockRing:
+    """
+    Single-producer/single-consumer ring of preallocated PCM blocks.
+    The audio callback copies each block into the next free slot, so nothing
+    is allocated or locked on the PortAudio thread. Only the producer moves
+    `head` and only the consumer moves `tail`; `ready` just wakes the consumer.
+    """
+
+    def __init__(self, slots: int, block_bytes: int):
+        if slots & (slots - 1):
+            raise ValueError("slots must be a power of two")
+        self.mask = slots - 1
+        self.views = [memoryview(bytearray(block_bytes)) for _ in range(slots)]
+        self.head = 0
+        self.tail = 0
+        self.ready = threading.Event()
+
+    def push(self, data) -> bool:
+        head = self.head
+        nxt = (head + 1) & self.mask
+        if nxt == self.tail:
+            return False
+        self.views[head][:] = data
+        self.head = nxt
+        if not self.ready.is_set():
+            self.ready.set()
+        return True
+
+    def pop_into(self, out: bytearray) -> bool:
+        """Append the oldest block to `out` (consumer side). False if the ring is empty."""
+        tail = self.tail
+        if tail == self.head:
+            return False
+        out += self.views[tail]
+        self.tail = (tail + 1) & self.mask
+        return True
+
+    def wait(self, timeout: float) -> None:
+        """Sleep until the producer pushes a block (consumer side)."""
+        self.ready.wait(timeout)
+        self.ready.clear()
+
+    def backlog(self) -> int:
+        """Blocks pushed but not popped yet."""
+        return (self.head - self.tail) & self.mask
+
+    def drop_oldest(self, keep: int) -> int:
+        """Discard all but the newest `keep` blocks (consumer side). Returns how many went."""
+        tail = self.tail
+        n = ((self.head - tail) & self.mask) - keep
+        if n <= 0:
+            return 0
+        self.tail = (tail + n) & self.mask
+        return n
+
+    def clear(self) -> None:
+        """Drop everything queued so far (consumer side)."""
+        self.tail = self.head
 
 
 class VoxTextApp(ctk.CTk):
@@ -51,26 +130,43 @@ class VoxTextApp(ctk.CTk):
         # State
         self.listening = False
         self.stop_event = threading.Event()
-        self.audio_q: "queue.Queue[np.ndarray]" = queue.Queue(maxsize=150)
+        self.finalize_requested = threading.Event()   # set on mute; stt_loop flushes and finalizes
+        self.audio_ring = None   # BlockRing, sized once the stream's block size is known
+        self.chunk = bytearray()   # blocks waiting for the next AcceptWaveform call
+        self.chunk_bytes = 0
+        # Blocks lost because the decoder fell behind: the callback counts a full
+        # ring, stt_loop counts stale audio it skipped (one writer each, no lock)
+        self.dropped_full = 0
+        self.dropped_stale = 0
+        self.callback_tuned = False   # PortAudio thread moves itself off STT_CPU on its first call
+        self.stt_fifo = False         # worker got SCHED_FIFO (only ever while pinned to STT_CPU)
 
         self.model = None
         self.rec = None
         self.stream = None
+        self.sr = None
+        self.model_dir = MODEL_DIR_LARGE
+        self.want_model = None   # model dir for stt_loop to switch to while muted
+        self.switch_requested = threading.Event()   # set when the picker changes while idle
+        self.load_done = threading.Event()
+        self.load_error = None
 
         self.last_final_text = ""
-        self.partial_last = ""
-        self.last_partial_t = 0.0
-        self.PARTIAL_THROTTLE_S = 0.08
+
+        # ("append", text) / ("status", text) / ("model", name) / ("ready", note or "")
+        # posted by stt_loop, applied on the Tk thread
+        self.results = deque()
 
         # UI
         self._build_ui()
 
-        # Init audio + worker
+        # Init audio + worker (the worker starts once the model and stream are up)
+        self.worker = threading.Thread(target=self.stt_loop, name="VoxSTT", daemon=True)
         self.init_vosk_and_stream()
-        self.worker = threading.Thread(target=self.stt_loop, daemon=True)
-        self.worker.start()
 
         self.protocol("WM_DELETE_WINDOW", self.on_close)
+        self.after(UI_POLL_MS, self._pump_results)
+        self.after(1000, self._show_drops)
 
     def _build_ui(self):
         # Main card container
@@ -112,6 +208,16 @@ class VoxTextApp(ctk.CTk):
             font=ctk.CTkFont(size=18, weight="bold")
         ).pack(side="left")
 
+        # Model picker (right); stt_loop loads the choice while muted
+        self.model_var = ctk.StringVar(value="Large")
+        self.model_picker = ctk.CTkSegmentedButton(
+            header,
+            values=list(MODEL_CHOICES),
+            variable=self.model_var,
+            command=self.choose_model
+        )
+        self.model_picker.pack(side="right")
+
         # Transcript box (no pre-filled text)
         self.textbox = ctk.CTkTextbox(
             container,
@@ -127,74 +233,186 @@ class VoxTextApp(ctk.CTk):
         self.textbox.insert("end", msg)
         self.textbox.see("end")
 
+    def _pump_results(self):
+        # One recurring Tk tick instead of an after(0, lambda) per result;
+        # everything posted since the last tick goes in with one insert/see
+        pending = []
+        while self.results:
+            kind, text = self.results.popleft()
+            if kind == "append":
+                pending.append(text)
+            elif kind == "status":
+                self.status_var.set(text)
+            elif kind == "model":
+                self.model_var.set(text)
+            else:
+                self.status_var.set(f"Muted ({text})" if text else "Muted")
+                self.mic_btn.configure(state="normal")
+                self.model_picker.configure(state="normal")
+        if pending:
+            self.append_final("".join(pending))
+        self.after(UI_POLL_MS, self._pump_results)
+
+    def choose_model(self, name: str):
+        model_dir = MODEL_CHOICES[name]
+        if not model_dir.exists():
+            self.status_var.set(f"Model not found: {model_dir.name}")
+            current = next(k for k, v in MODEL_CHOICES.items() if v == self.model_dir)
+            self.model_var.set(current)
+            return
+        self.want_model = model_dir
+        if not self.listening:
+            # Idle: switch now. Otherwise it happens on the next mute, after the final.
+            self.mic_btn.configure(state="disabled")
+            self.model_picker.configure(state="disabled")
+            self.switch_requested.set()
+            self.audio_ring.ready.set()   # wake the worker now rather than on its next timeout
+
+    def _show_drops(self):
+        # Once a second is plenty for a debugging hint; avoids a Tk update per drop
+        drops = self.dropped_full + self.dropped_stale
+        if self.listening and drops:
+            note = "; small model on mute" if self.want_model == MODEL_DIR_SMALL else ""
+            self.status_var.set(f"Unmuted (dropped {drops}{note})")
+        self.after(1000, self._show_drops)
+
     def init_vosk_and_stream(self):
-        if not MODEL_DIR.exists():
-            raise SystemExit(f"Model not found: {MODEL_DIR}")
+        if not MODEL_DIR_LARGE.exists():
+            raise SystemExit(f"Model not found: {MODEL_DIR_LARGE}")
+
+        # Loading the model takes seconds on a Pi; do it off the Tk thread so the
+        # window paints right away. The mic stays disabled until it's ready.
+        self.status_var.set("Loading model...")
+        self.mic_btn.configure(state="disabled")
+        self.model_picker.configure(state="disabled")
+        threading.Thread(target=self._load_vosk_and_stream, daemon=True).start()
+        self.after(100, self._wait_for_load)
+
+    def _wait_for_load(self):
+        if not self.load_done.is_set():
+            self.after(100, self._wait_for_load)
+            return
+
+        if self.load_error is not None:
+            raise SystemExit(str(self.load_error))
+
+        self.worker.start()
+        self.status_var.set("Muted")
+        self.mic_btn.configure(state="normal")
+        self.model_picker.configure(state="normal")
+
+    def _load_vosk_and_stream(self):
+        try:
+            self._open_vosk_and_stream()
+        except Exception as e:
+            self.load_error = e
+        self.load_done.set()
 
-        dev = DEVICE if DEVICE is not None else pick_input_device("Adafruit")
+    def _open_vosk_and_stream(self):
+        if DEVICE is not None:
+            dev, d = DEVICE, sd.query_devices(DEVICE)
+        else:
+            dev, d = pick_input_device("Adafruit")
 
-        # Use device native sample rate (more reliable on Pi/USB mics)
         if dev is not None:
-            d = sd.query_devices(dev)
             print(f"Using device {dev}: {d['name']}")
         else:
             d = sd.query_devices(sd.default.device[0])
             print("Using default input device")
 
+        # Capture at 16 kHz when the device (or PortAudio/ALSA) can deliver it;
+        # otherwise use the device native rate (more reliable on Pi/USB mics)
         native_sr = int(d["default_samplerate"])
-        block_size = int(native_sr * BLOCK_MS / 1000)
+        try:
+            sd.check_input_settings(device=dev, channels=1, samplerate=TARGET_SR, dtype="int16")
+            sr = TARGET_SR
+        except Exception:
+            sr = native_sr
+        block_size = int(sr * BLOCK_MS / 1000)
+        print(f"Capturing at {sr} Hz")
+
+        # Vosk recognizer must match incoming sample rate (it resamples internally if needed)
+        self.sr = sr
+        self.model = Model(str(self.model_dir))
+        self.rec = self._make_recognizer(self.model)
 
-        # Vosk recognizer must match incoming sample rate
-        self.model = Model(str(MODEL_DIR))
-        self.rec = KaldiRecognizer(self.model, native_sr)
-        self.rec.SetWords(True)
+        self.audio_ring = BlockRing(AUDIO_SLOTS, block_size * 2)
+        self.chunk_bytes = int(sr * CHUNK_MS / 1000) * 2
+        self.tail_silence = bytes(int(sr * TAIL_SILENCE_MS / 1000) * 2)
 
         try:
-            sd.check_input_settings(device=dev, channels=1, samplerate=native_sr, dtype="float32")
-            self.stream = sd.InputStream(
-                samplerate=native_sr,
+            # Ask PortAudio for int16 PCM, which is what Vosk consumes
+            sd.check_input_settings(device=dev, channels=1, samplerate=sr, dtype="int16")
+            self.stream = sd.RawInputStream(
+                samplerate=sr,
                 blocksize=block_size,
                 device=dev,
                 channels=1,
-                dtype="float32",
+                dtype="int16",
                 callback=self.audio_callback,
             )
             self.stream.start()
         except Exception as e:
-            raise SystemExit(f"ERROR starting stream: {e}")
+            raise RuntimeError(f"ERROR starting stream: {e}") from e
+
+    def _make_recognizer(self, model):
+        rec = KaldiRecognizer(model, self.sr)
+        rec.SetWords(True)
+        # Finals are committed by stt_loop whenever Vosk hits an endpoint, so
+        # shorter endpoints mean less text waiting for the mute to show up.
+        # Released vosk (<= 0.3.45) has neither the enum nor the setter: no-op there.
+        modes = getattr(vosk, "EndpointerMode", None)
+        set_mode = getattr(rec, "SetEndpointerMode", None)
+        if modes is not None and set_mode is not None:
+            try:
+                set_mode(modes[ENDPOINTER_MODE])
+            except Exception as e:
+                print(f"SetEndpointerMode({ENDPOINTER_MODE}) failed: {e}", file=sys.stderr)
+        return rec
+
+    def _tune_callback_thread(self):
+        # PortAudio creates this thread before the worker pins itself, so it
+        # inherits the full process mask. Narrow it here (pid 0 = this thread)
+        # so the SCHED_FIFO worker on STT_CPU can never starve capture.
+        self.callback_tuned = True
+        if STT_CPU is None or not hasattr(os, "sched_setaffinity"):
+            return
+        try:
+            others = os.sched_getaffinity(0) - {STT_CPU}
+            if others:
+                os.sched_setaffinity(0, others)
+        except OSError:
+            pass
 
     def audio_callback(self, indata, frames, time_info, status):
+        if not self.callback_tuned:
+            self._tune_callback_thread()
         if status:
             print(status, file=sys.stderr)
 
         if not self.listening:
             return
 
-        pcm16 = (indata[:, 0] * 32767).astype(np.int16)
-        try:
-            self.audio_q.put_nowait(pcm16)
-        except queue.Full:
-            pass
+        # indata is already int16 mono PCM; copy it out of PortAudio's buffer
+        # into a preallocated slot, or drop it if the worker has fallen behind
+        if not self.audio_ring.push(indata):
+            self.dropped_full += 1
 
     def toggle_listening(self):
         if not self.listening:
-            # Start (unmute)
+            # Start (unmute). While muted stt_loop leaves the ring and recognizer
+            # alone, so reset them (fresh start) before listening lets it back in.
+            self.last_final_text = ""
+            self.rec.Reset()
+            self.audio_ring.clear()
+            self.chunk.clear()
+            self.dropped_full = 0
+            self.dropped_stale = 0
+
             self.listening = True
             self.mic_btn.configure(fg_color=LIVE_GREEN, hover_color="#16a34a")
             self.status_var.set("Unmuted")
             self.status_label.configure(text_color=LIVE_GREEN)
-
-            self.last_final_text = ""
-            self.partial_last = ""
-            self.last_partial_t = 0.0
-            self.rec.Reset()
-
-            # Clear any old queued chunks (fresh start)
-            while True:
-                try:
-                    self.audio_q.get_nowait()
-                except queue.Empty:
-                    break
         else:
             # Stop (mute) + finalize
             self.listening = False
@@ -202,49 +420,171 @@ class VoxTextApp(ctk.CTk):
             self.status_var.set("Muted")
             self.status_label.configure(text_color=MUTED_RED)
 
-            # Drain a little then finalize
-            deadline = time.time() + 0.4
-            while time.time() < deadline:
-                try:
-                    pcm16 = self.audio_q.get_nowait()
-                except queue.Empty:
-                    break
-                self.rec.AcceptWaveform(pcm16.tobytes())
+            # stt_loop owns the recognizer: it drains everything captured so far,
+            # finalizes and reports back through results. The mic stays disabled until then.
+            self.mic_btn.configure(state="disabled")
+            self.model_picker.configure(state="disabled")
+            self.finalize_requested.set()
+            self.audio_ring.ready.set()   # wake the worker now rather than on its next timeout
+
+    def _finalize(self):
+        # Runs on the worker once listening is off, so nothing new is pushed:
+        # take every block still in the ring and decode it in a single Vosk call
+        while self.audio_ring.pop_into(self.chunk):
+            pass
+        # Plus a little silence, so the last word isn't cut off mid-decode
+        self.chunk += self.tail_silence
+        self.rec.AcceptWaveform(bytes(self.chunk))
+        self.chunk.clear()
+
+        try:
+            res = _json.loads(self.rec.FinalResult())
+            text = (res.get("text") or "").strip()
+        except Exception:
+            text = ""
 
+        if len(text) >= MIN_FINAL_CHARS and text != self.last_final_text:
+            self.last_final_text = text
+            self.results.append(("append", f"{text}\n\n"))
+        else:
+            self.results.append(("append", "(nothing detected)\n\n"))
+        self.results.append(("ready", self._switch_model()))
+
+    def _switch_model(self) -> str:
+        # Worker side, between utterances: the mic stays disabled until "ready".
+        # Returns a note for the status line ("" if there's nothing to say).
+        model_dir, self.want_model = self.want_model, None
+        if model_dir is None or model_dir == self.model_dir:
+            return ""
+        smaller = model_dir == MODEL_DIR_SMALL
+        self.results.append(("status", "Loading smaller model..." if smaller else "Loading larger model..."))
+        note = ""
+        try:
+            # A multi-second load is no job for a real-time thread
+            self._set_stt_fifo(False)
+            model = Model(str(model_dir))
+            rec = self._make_recognizer(model)
+        except Exception as e:
+            print(f"Could not load {model_dir.name}: {e}", file=sys.stderr)
+            note = f"could not load {model_dir.name}"
+            model_dir = self.model_dir
+        else:
+            self.model, self.rec, self.model_dir = model, rec, model_dir
+        finally:
+            self._set_stt_fifo(True)
+        name = next(k for k, v in MODEL_CHOICES.items() if v == model_dir)
+        self.results.append(("model", name))
+        return note
+
+    def _tune_stt_thread(self):
+        # On Linux, pid 0 here means "this thread": keep Kaldi on one warm core and
+        # let it preempt the GUI. Real-time scheduling needs root or CAP_SYS_NICE
+        # (e.g. setcap cap_sys_nice+ep on the python binary); otherwise it is skipped.
+        # The audio callback keeps itself off STT_CPU (_tune_callback_thread), since
+        # this loop doesn't sleep while it is behind; so FIFO is only asked for once
+        # the pin has taken, never for a worker that could land on the capture core.
+        if STT_CPU is None or not hasattr(os, "sched_setaffinity"):
+            return
+        try:
+            if STT_CPU not in os.sched_getaffinity(0):
+                return
+            os.sched_setaffinity(0, {STT_CPU})
+        except OSError:
+            return
+        if STT_RT_PRIORITY and hasattr(os, "sched_setscheduler"):
             try:
-                res = json.loads(self.rec.FinalResult())
-                text = (res.get("text") or "").strip()
-            except Exception:
-                text = ""
+                os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(STT_RT_PRIORITY))
+                self.stt_fifo = True
+            except OSError:
+                pass
 
-            if len(text) >= MIN_FINAL_CHARS and text != self.last_final_text:
-                self.last_final_text = text
-                self.after(0, lambda t=text: self.append_final(f"{t}\n\n"))
+    def _set_stt_fifo(self, on: bool):
+        # Worker side: drop to SCHED_OTHER around slow non-decode work and back after
+        if not self.stt_fifo:
+            return
+        try:
+            if on:
+                os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(STT_RT_PRIORITY))
             else:
-                self.after(0, lambda: self.append_final("(nothing detected)\n\n"))
+                os.sched_setscheduler(0, os.SCHED_OTHER, os.sched_param(0))
+        except OSError:
+            pass
 
     def stt_loop(self):
-        while not self.stop_event.is_set():
-            try:
-                pcm16 = self.audio_q.get(timeout=0.1)
-            except queue.Empty:
+        self._tune_stt_thread()
+
+        # Hot loop: bind everything it touches per block to locals once
+        ring = self.audio_ring
+        pop_into = ring.pop_into
+        wait = ring.wait
+        drop_oldest = ring.drop_oldest
+        chunk = self.chunk
+        chunk_bytes = self.chunk_bytes
+        max_backlog = MAX_BACKLOG_MS // BLOCK_MS
+        stopping = self.stop_event.is_set
+        finalizing = self.finalize_requested.is_set
+        post = self.results.append
+        accept = self.rec.AcceptWaveform
+        result = self.rec.Result
+        lag_blocks = LAG_TRIGGER_MS // BLOCK_MS
+        lag_since = None
+
+        while not stopping():
+            if finalizing():
+                self.finalize_requested.clear()
+                self._finalize()
+                # _finalize may have swapped in another model
+                accept = self.rec.AcceptWaveform
+                result = self.rec.Result
+                lag_since = None
+                continue
+
+            # Model picked while idle (only set while muted, with the mic disabled)
+            if self.switch_requested.is_set():
+                self.switch_requested.clear()
+                self.results.append(("ready", self._switch_model()))
+                accept = self.rec.AcceptWaveform
+                result = self.rec.Result
                 continue
 
+            # Leave the ring alone while muted; toggle_listening owns it then
             if not self.listening:
+                wait(0.1)
                 continue
 
-            data = pcm16.tobytes()
+            # Behind by more than MAX_BACKLOG_MS: skip the stalest audio so what
+            # the user is saying now still gets decoded promptly
+            self.dropped_stale += drop_oldest(max_backlog)
+            if not pop_into(chunk):
+                wait(0.1)
+                continue
+            if len(chunk) < chunk_bytes:
+                continue
+
+            # Still this far behind after LAG_TRIGGER_S: the model is too slow for this CPU
+            if ring.backlog() >= lag_blocks:
+                now = time.monotonic()
+                if lag_since is None:
+                    lag_since = now
+                elif (now - lag_since >= LAG_TRIGGER_S and self.want_model is None
+                      and self.model_dir != MODEL_DIR_SMALL and MODEL_DIR_SMALL.exists()):
+                    self.want_model = MODEL_DIR_SMALL
+                    post(("status", "Unmuted (falling behind; small model on mute)"))
+            else:
+                lag_since = None
 
-            if self.rec.AcceptWaveform(data):
-                res = json.loads(self.rec.Result())
+            data = bytes(chunk)   # Vosk only accepts bytes
+            chunk.clear()
+
+            # Partial results are intentionally NOT shown in transcript
+            # (you asked to avoid showing pre-transcript/partial output),
+            # so PartialResult() is never called: no hypothesis copy or JSON per chunk
+            if accept(data):
+                res = _json.loads(result())
                 text = (res.get("text") or "").strip()
                 if len(text) >= MIN_FINAL_CHARS and text != self.last_final_text:
                     self.last_final_text = text
-                    self.after(0, lambda t=text: self.append_final(f"{t}\n\n"))
-            else:
-                # Partial results are intentionally NOT shown in transcript
-                # (you asked to avoid showing pre-transcript/partial output)
-                pass
+                    post(("append", f"{text}\n\n"))
 
     def on_close(self):
         self.stop_event.set()